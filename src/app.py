@@ -1,18 +1,269 @@
 import os
-from flask import Flask, render_template, request
+import functools
+import gzip
+import hashlib
+import threading
+from concurrent.futures import Future
+from types import MappingProxyType, SimpleNamespace
+from flask import Flask, Response, jsonify, render_template, request
+import orjson
+import pybreaker
 import requests
-from dotenv import load_dotenv
+from cachetools import TTLCache
+import diskcache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import dotenv_values
 
-# Загружаем переменные окружения из .env файла
-load_dotenv()
+@functools.cache
+def _config():
+    """
+    Настройки приложения из переменных окружения, а при их отсутствии — из .env файла.
+    Все настройки читаются при загрузке модуля; кэш нужен, чтобы .env разбирался один раз.
+    В отличие от load_dotenv(), os.environ не изменяется, поэтому всё, что может прийти из .env
+    (в том числе прокси и CA-бандл для requests), берётся только отсюда.
+    """
+    file_values = dotenv_values()
+
+    def get(name, default=None):
+        return os.environ.get(name, file_values.get(name, default))
+
+    def get_any(*names):
+        # Переменные прокси бывают и в верхнем, и в нижнем регистре
+        return next((value for value in map(get, names) if value), None)
+
+    proxies = {
+        scheme: get_any(f"{scheme}_proxy", f"{scheme.upper()}_PROXY")
+        for scheme in ("http", "https", "all")
+    }
+    return SimpleNamespace(
+        api_key=get("MENTORPIECE_API_KEY"),
+        api_url=get("MENTORPIECE_API_URL", "https://api.mentorpiece.org/v1/process-ai-request"),
+        cache_dir=get("TRANSLATOR_CACHE_DIR"),
+        semantic_cache_model=get("TRANSLATOR_SEMANTIC_CACHE_MODEL"),
+        semantic_cache_onnx=get("TRANSLATOR_SEMANTIC_CACHE_ONNX"),
+        gzip_requests=(get("MENTORPIECE_GZIP_REQUESTS") or "").lower() in ("1", "true", "yes"),
+        proxies={scheme: url for scheme, url in proxies.items() if url},
+        no_proxy=get_any("no_proxy", "NO_PROXY"),
+        ca_bundle=get_any("REQUESTS_CA_BUNDLE", "CURL_CA_BUNDLE")
+    )
+
+# Получаем API ключ и адрес API
+API_KEY = _config().api_key
+API_URL = _config().api_url
+
+# Общая HTTP-сессия: пул keep-alive соединений избавляет от TCP/TLS-рукопожатия на каждый вызов LLM
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        # Повторяем только ошибки подключения (запрос не дошёл до API) и ответы из status_forcelist.
+        # Таймаут чтения не повторяем: генерация уже идёт, и повтор стоил бы ещё одну оплаченную генерацию
+        # и ещё до 30 секунд занятого потока
+        read=0,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True
+    )
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+# Прокси и CA-бандл из окружения определяем один раз; иначе requests на каждом вызове
+# заново разбирает переменные окружения и ищет ~/.netrc (который к тому же подменил бы наш Authorization)
+if not requests.utils.should_bypass_proxies(API_URL, no_proxy=_config().no_proxy):
+    SESSION.proxies.update(_config().proxies)
+SESSION.verify = _config().ca_bundle or True
+SESSION.trust_env = False
+# Заголовки собираются один раз при загрузке модуля и передаются в сессию, а не создаются на каждый вызов
+_AUTH_HEADERS = MappingProxyType({
+    "Authorization": f"Bearer {API_KEY}",
+    "Content-Type": "application/json"
+})
+_STREAM_HEADERS = MappingProxyType({"Accept": "text/event-stream"})
+_GZIP_HEADERS = MappingProxyType({"Content-Encoding": "gzip"})
+_STREAM_GZIP_HEADERS = MappingProxyType({**_STREAM_HEADERS, **_GZIP_HEADERS})
+SESSION.headers.update(_AUTH_HEADERS)
+
+# Сжатие тел запросов больше GZIP_MIN_SIZE байт. Включается через MENTORPIECE_GZIP_REQUESTS,
+# только если API принимает Content-Encoding: gzip. Ответы сжимаются и так: requests отправляет
+# Accept-Encoding: gzip, deflate, br (br — при установленном пакете brotli)
+GZIP_REQUESTS = _config().gzip_requests
+GZIP_MIN_SIZE = 1024
+
+# Таймауты (подключение, чтение): недоступный API отсекается за секунды, а ответ модели можно ждать дольше
+LLM_TIMEOUT = (3.05, 30)
+
+# In-process кэш успешных ответов LLM по ключу (model_name, prompt)
+_CACHE = TTLCache(maxsize=4096, ttl=3600)
+_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {"hits": 0, "misses": 0, "disk_hits": 0}
+
+# Запросы к API, которые выполняются прямо сейчас: одновременные одинаковые вызовы ждут
+# результата уже отправленного запроса, а не дублируют его
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+# Дисковый кэш, общий для воркеров gunicorn и переживающий перезапуск (включается через TRANSLATOR_CACHE_DIR)
+CACHE_DIR = _config().cache_dir
+DISK_CACHE = diskcache.Cache(CACHE_DIR, size_limit=2**30) if CACHE_DIR else None
+DISK_CACHE_TTL = 86400
+
+# Семантический кэш переводов (опционально): эмбеддинги через ONNX Runtime или sentence-transformers
+SEMANTIC_CACHE_MODEL = _config().semantic_cache_model
+SEMANTIC_CACHE_ONNX = _config().semantic_cache_onnx
+SEMANTIC_CACHE = None
+if SEMANTIC_CACHE_ONNX:
+    from semantic_cache import OnnxEncoder, SemanticCache
+    SEMANTIC_CACHE = SemanticCache(OnnxEncoder(SEMANTIC_CACHE_ONNX))
+elif SEMANTIC_CACHE_MODEL:
+    from semantic_cache import SemanticCache, SentenceTransformerEncoder
+    SEMANTIC_CACHE = SemanticCache(SentenceTransformerEncoder(SEMANTIC_CACHE_MODEL))
+
+# Модели для перевода и оценки
+TRANSLATE_MODEL = "Qwen/Qwen3-VL-30B-A3B-Instruct"
+JUDGE_MODEL = "claude-sonnet-4-5-20250929"
+
+# Поддерживаемые языки перевода и шаблоны промптов
+_LANG_MAP = MappingProxyType({'en': 'English', 'fr': 'French', 'de': 'German'})
+_TRANSLATE_TMPL = "Переведи следующий текст на {lang}:\n{text}".format
+_JUDGE_TMPL = (
+    "Оригинал: {original}\nПеревод: {translated}\n"
+    "Оцени качество перевода от 1 до 10 и аргументируй."
+).format
+
+# Ответ на пустой ввод: в этом случае к LLM не обращаемся
+_EMPTY_TEXT_MESSAGE = 'Введите текст для перевода.'
 
-# Получаем API ключ из переменных окружения
-API_KEY = os.getenv("MENTORPIECE_API_KEY")
-API_URL = os.getenv("MENTORPIECE_API_URL", "https://api.mentorpiece.org/v1/process-ai-request")
+class NoModelResponseError(Exception):
+    """API ответил успешно, но без поля `response`. Такой ответ не считается переводом и не кэшируется."""
+
+def _model_response(payload):
+    """Текст ответа модели из JSON-ответа API; без поля `response` — исключение."""
+    result = payload.get("response")
+    if result is None:
+        raise NoModelResponseError("Нет ответа от модели.")
+    return result
+
+# Ошибки обращения к LLM API, которые превращаются в сообщение для пользователя
+_LLM_ERRORS = (
+    requests.exceptions.RequestException,
+    orjson.JSONDecodeError,
+    pybreaker.CircuitBreakerError,
+    NoModelResponseError
+)
+
+# После 10 неудачных запросов подряд размыкаем цепь на 30 секунд: вызовы сразу завершаются ошибкой,
+# не занимая поток ожиданием заведомо недоступного API.
+# Используется через `with _BREAKER.calling()`: CircuitBreaker.call() и декоратор держат блокировку
+# автомата на всё время вызова и тем самым выстраивают все запросы процесса в очередь
+_BREAKER = pybreaker.CircuitBreaker(fail_max=10, reset_timeout=30)
 
 # Инициализация Flask-приложения
 app = Flask(__name__)
 
+def _maybe_gzip(body):
+    """Сжимает тело запроса gzip, если сжатие включено и тело достаточно большое. Возвращает (тело, сжато ли)."""
+    if GZIP_REQUESTS and len(body) > GZIP_MIN_SIZE:
+        return gzip.compress(body), True
+    return body, False
+
+def _post_llm(model_name, prompt):
+    """Запрос к LLM API без кэша. Ошибки сети, HTTP, разбора JSON и ответ без `response` пробрасываются."""
+    data = {
+        "model_name": model_name,
+        "prompt": prompt
+    }
+    body, compressed = _maybe_gzip(orjson.dumps(data))
+    with _BREAKER.calling():
+        response = SESSION.post(
+            API_URL,
+            data=body,
+            headers=_GZIP_HEADERS if compressed else None,
+            timeout=LLM_TIMEOUT
+        )
+        response.raise_for_status()  # Генерирует исключение для 4xx/5xx
+        payload = orjson.loads(response.content)
+    return _model_response(payload)
+
+def _disk_key(model_name, prompt):
+    """Ключ дискового кэша: короткий хэш модели и промпта."""
+    return hashlib.blake2b(f"{model_name}\0{prompt}".encode(), digest_size=16).hexdigest()
+
+def _cache_get(model_name, prompt):
+    """Ответ из in-process или дискового кэша; None, если его там нет."""
+    key = (model_name, prompt)
+    with _CACHE_LOCK:
+        try:
+            result = _CACHE[key]
+        except KeyError:
+            _CACHE_STATS["misses"] += 1
+        else:
+            _CACHE_STATS["hits"] += 1
+            return result
+    if DISK_CACHE is not None:
+        result = DISK_CACHE.get(_disk_key(model_name, prompt))
+        if result is not None:
+            with _CACHE_LOCK:
+                _CACHE_STATS["disk_hits"] += 1
+                _CACHE[key] = result
+            return result
+    return None
+
+def _cache_put(model_name, prompt, result):
+    """Сохраняет успешный ответ в in-process и дисковый кэш."""
+    with _CACHE_LOCK:
+        _CACHE[(model_name, prompt)] = result
+    if DISK_CACHE is not None:
+        DISK_CACHE.set(_disk_key(model_name, prompt), result, expire=DISK_CACHE_TTL)
+
+def _inflight_join(key):
+    """
+    Присоединяет вызов к уже идущему запросу с тем же ключом или регистрирует новый.
+    :return: (Future с ответом, должен ли вызывающий сам выполнить запрос)
+    """
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(key)
+        if future is not None:
+            return future, False
+        # Первый вызов мог сохранить ответ и завершиться между проверкой кэша и этой блокировкой
+        with _CACHE_LOCK:
+            result = _CACHE.get(key)
+        future = Future()
+        if result is not None:
+            future.set_result(result)
+            return future, False
+        _INFLIGHT[key] = future
+        return future, True
+
+def _call_llm_cached(model_name, prompt):
+    """
+    Обращение к LLM API с кэшированием.
+    В кэш попадают только успешные ответы: ошибки пробрасываются вызывающему коду.
+    """
+    result = _cache_get(model_name, prompt)
+    if result is not None:
+        return result
+    key = (model_name, prompt)
+    future, is_leader = _inflight_join(key)
+    if not is_leader:
+        # Время ожидания ограничено таймаутами и повторами запроса, который выполняет первый вызов
+        return future.result()
+    try:
+        result = _post_llm(model_name, prompt)
+        _cache_put(model_name, prompt, result)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+    return result
+
 def call_llm(model_name, prompt):
     """
     Вспомогательная функция для обращения к LLM API.
@@ -20,25 +271,130 @@ def call_llm(model_name, prompt):
     :param prompt: Строка с промптом или сообщением
     :return: Ответ модели (строка) или сообщение об ошибке
     """
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+    try:
+        return _call_llm_cached(model_name, prompt)
+    except _LLM_ERRORS as e:
+        # Обработка сетевых ошибок и ошибок API
+        return f"Ошибка при обращении к LLM API: {e}"
+
+def call_llm_similar(model_name, prompt, namespace, text):
+    """
+    То же, что `call_llm`, но сначала ищет в семантическом кэше ответ для близкого по смыслу `text`.
+    Без включённого семантического кэша равносильна `call_llm`.
+    :param namespace: Пространство имён кэша (например, целевой язык перевода)
+    :param text: Текст, по близости к которому ищется готовый ответ
+    """
+    if SEMANTIC_CACHE is None:
+        return call_llm(model_name, prompt)
+    try:
+        return SEMANTIC_CACHE.get_or_compute(
+            namespace, text, lambda: _call_llm_cached(model_name, prompt)
+        )
+    except _LLM_ERRORS as e:
+        return f"Ошибка при обращении к LLM API: {e}"
+
+def call_llm_stream(model_name, prompt):
+    """
+    Потоковое обращение к LLM API (`"stream": true`, ответ в формате SSE).
+    :return: Генератор фрагментов ответа модели. Если API ответил обычным JSON,
+             генератор выдаёт ответ целиком. Ошибки пробрасываются при итерации.
+    """
     data = {
         "model_name": model_name,
-        "prompt": prompt
+        "prompt": prompt,
+        "stream": True
     }
+    body, compressed = _maybe_gzip(orjson.dumps(data))
+    # Автомат защиты учитывает подключение и статус ответа; обрыв уже идущего потока в нём не считается
+    with _BREAKER.calling():
+        response = SESSION.post(
+            API_URL,
+            data=body,
+            headers=_STREAM_GZIP_HEADERS if compressed else _STREAM_HEADERS,
+            timeout=LLM_TIMEOUT,
+            stream=True
+        )
+        try:
+            response.raise_for_status()
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+    with response:
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            yield _model_response(orjson.loads(response.content))
+            return
+        for line in response.iter_lines():
+            # Нас интересуют только строки `data: {...}`; пустые строки разделяют события
+            if not line.startswith(b"data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == b"[DONE]":
+                break
+            chunk = orjson.loads(payload).get("response", "")
+            if chunk:
+                yield chunk
+
+def _call_llm_stream_cached(model_name, prompt):
+    """
+    `call_llm_stream` с объединением одинаковых запросов, как в `_call_llm_cached`.
+    Если тот же промпт уже запрашивается (потоком или обычным запросом), генератор ждёт его
+    и выдаёт ответ одним фрагментом. Иначе фрагменты выдаются по мере получения,
+    а склеенный ответ сохраняется в кэш. Поток без фрагментов — ошибка `NoModelResponseError`.
+    """
+    key = (model_name, prompt)
+    future, is_leader = _inflight_join(key)
+    if not is_leader:
+        yield future.result()
+        return
+    parts = []
     try:
-        response = requests.post(API_URL, headers=headers, json=data, timeout=30)
-        response.raise_for_status()  # Генерирует исключение для 4xx/5xx
-        result = response.json()
-        return result.get("response", "Нет ответа от модели.")
-    except requests.exceptions.RequestException as e:
-        # Обработка сетевых ошибок и ошибок API
-        return f"Ошибка при обращении к LLM API: {e}"
+        for chunk in call_llm_stream(model_name, prompt):
+            parts.append(chunk)
+            yield chunk
+        # Поток без единого фрагмента (сразу [DONE]) — это не пустой перевод, а отсутствие ответа
+        if not parts:
+            raise NoModelResponseError("Нет ответа от модели.")
+        result = "".join(parts)
+        _cache_put(model_name, prompt, result)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    except BaseException:
+        # Клиент ушёл, не дочитав поток: ожидающие вызовы получают ошибку, а не обрезанный ответ
+        future.set_exception(requests.exceptions.ConnectionError("Потоковый запрос прерван."))
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+
+def _cached_translation(prompt, target_lang, original_text):
+    """Готовый перевод из точного (память, диск) или семантического кэша; None, если его нет."""
+    result = _cache_get(TRANSLATE_MODEL, prompt)
+    if result is None and SEMANTIC_CACHE is not None:
+        result = SEMANTIC_CACHE.get(target_lang, original_text)
+    return result
+
+def _sse(event):
+    """Кодирует словарь в событие Server-Sent Events."""
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+# Пустая форма не зависит от запроса, поэтому рендерим её один раз при старте
+with app.app_context():
+    _INDEX_HTML = render_template(
+        'index.html',
+        original_text='',
+        translated_text='',
+        verdict='',
+        selected_lang='en'
+    )
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
+    # При автоперезагрузке шаблонов (режим отладки) рендерим заново, чтобы видеть правки
+    if request.method == 'GET' and not app.jinja_env.auto_reload:
+        return _INDEX_HTML
     original_text = ''
     translated_text = ''
     verdict = ''
@@ -47,24 +403,30 @@ def index():
         # Получаем данные из формы
         original_text = request.form.get('original_text', '')
         selected_lang = request.form.get('language', 'en')
+        # Пустой ввод переводить и оценивать нечего
+        if not original_text.strip():
+            return render_template(
+                'index.html',
+                original_text='',
+                translated_text='',
+                verdict=_EMPTY_TEXT_MESSAGE,
+                selected_lang=selected_lang
+            )
         # Формируем промпт для перевода
-        lang_map = {'en': 'English', 'fr': 'French', 'de': 'German'}
-        target_lang = lang_map.get(selected_lang, 'English')
-        translate_prompt = f"Переведи следующий текст на {target_lang}:\n{original_text}"
+        target_lang = _LANG_MAP.get(selected_lang, 'English')
+        translate_prompt = _TRANSLATE_TMPL(lang=target_lang, text=original_text)
         # Шаг 1: Перевод текста
-        translated_text = call_llm(
-            "Qwen/Qwen3-VL-30B-A3B-Instruct",
-            translate_prompt
-        )
-        # Шаг 2: Оценка перевода
-        judge_prompt = (
-            f"Оригинал: {original_text}\nПеревод: {translated_text}\n"
-            "Оцени качество перевода от 1 до 10 и аргументируй."
-        )
-        verdict = call_llm(
-            "claude-sonnet-4-5-20250929",
-            judge_prompt
+        translated_text = call_llm_similar(
+            TRANSLATE_MODEL,
+            translate_prompt,
+            target_lang,
+            original_text
         )
+        # Шаг 2: Оценка перевода.
+        # Оценивает другая модель, и её промпт содержит готовый перевод, поэтому шаги
+        # нельзя объединить в один запрос или выполнить параллельно.
+        judge_prompt = _JUDGE_TMPL(original=original_text, translated=translated_text)
+        verdict = call_llm(JUDGE_MODEL, judge_prompt)
     # Рендерим HTML-шаблон с результатами
     return render_template(
         'index.html',
@@ -74,6 +436,54 @@ def index():
         selected_lang=selected_lang
     )
 
+@app.route('/translate-stream', methods=['POST'])
+def translate_stream():
+    """
+    Потоковый вариант формы: перевод отправляется клиенту по мере генерации (события `translation`),
+    оценка — одним событием `verdict` после завершения перевода.
+    """
+    original_text = request.form.get('original_text', '')
+    selected_lang = request.form.get('language', 'en')
+    if not original_text.strip():
+        return Response(_sse({"error": _EMPTY_TEXT_MESSAGE}), mimetype='text/event-stream')
+    target_lang = _LANG_MAP.get(selected_lang, 'English')
+    translate_prompt = _TRANSLATE_TMPL(lang=target_lang, text=original_text)
+
+    def generate():
+        # Уже переведённый текст отдаём одним событием, без обращения к API
+        translated_text = _cached_translation(translate_prompt, target_lang, original_text)
+        if translated_text is not None:
+            yield _sse({"translation": translated_text})
+        else:
+            parts = []
+            try:
+                for chunk in _call_llm_stream_cached(TRANSLATE_MODEL, translate_prompt):
+                    parts.append(chunk)
+                    yield _sse({"translation": chunk})
+            except _LLM_ERRORS as e:
+                yield _sse({"error": f"Ошибка при обращении к LLM API: {e}"})
+                return
+            # Точный кэш заполняет _call_llm_stream_cached
+            translated_text = "".join(parts)
+            if SEMANTIC_CACHE is not None:
+                SEMANTIC_CACHE.put(target_lang, original_text, translated_text)
+        judge_prompt = _JUDGE_TMPL(original=original_text, translated=translated_text)
+        yield _sse({"verdict": call_llm(JUDGE_MODEL, judge_prompt)})
+
+    return Response(generate(), mimetype='text/event-stream')
+
+@app.route('/metrics')
+def metrics():
+    # Счётчики попаданий и промахов кэша ответов LLM
+    with _CACHE_LOCK:
+        return jsonify(
+            hits=_CACHE_STATS["hits"],
+            misses=_CACHE_STATS["misses"],
+            disk_hits=_CACHE_STATS["disk_hits"],
+            size=len(_CACHE),
+            maxsize=_CACHE.maxsize
+        )
+
 if __name__ == '__main__':
     # Запуск приложения в режиме отладки
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,154 @@
+"""
+Семантический кэш переводов.
+
+Точный кэш в `app.py` не срабатывает на почти одинаковых текстах
+("Привет мир" и "Привет, мир!"). Здесь исходные тексты переводятся в эмбеддинги,
+и если косинусная близость нового текста к уже переведённому выше порога,
+возвращается сохранённый перевод без обращения к LLM API.
+
+Модуль опциональный: нужен пакет `sentence-transformers` (и `numpy`),
+включается переменной окружения `TRANSLATOR_SEMANTIC_CACHE_MODEL`.
+Вместо PyTorch эмбеддинги можно считать через ONNX Runtime на квантованной в int8 модели
+(`TRANSLATOR_SEMANTIC_CACHE_ONNX`, нужны `onnxruntime` и `tokenizers`) — в несколько раз быстрее на CPU.
+"""
+
+import os
+import threading
+
+import numpy as np
+
+
+def mean_pool(hidden, attention_mask):
+    """
+    Эмбеддинг текста из выходов энкодера, как в sentence-transformers: среднее по токенам
+    без паддинга, нормированное до единичной длины.
+    :param hidden: Скрытые состояния токенов, массив (число токенов, размерность)
+    :param attention_mask: Маска токенов (1 — токен текста, 0 — паддинг), массив (число токенов,)
+    :return: Нормированный вектор float32
+    """
+    mask = np.asarray(attention_mask, dtype=np.float32)[:, None]
+    emb = (hidden * mask).sum(axis=0) / mask.sum()
+    return (emb / np.linalg.norm(emb)).astype(np.float32)
+
+
+class SentenceTransformerEncoder:
+    """Эмбеддинги через sentence-transformers на CPU (например, all-MiniLM-L6-v2, 384 измерения)."""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model_name, device='cpu')
+
+    def __call__(self, text):
+        # Модель обрезает текст до max_seq_length токенов: эмбеддинг описывал бы только его начало
+        if len(self._model.tokenizer(text, verbose=False)['input_ids']) > self._model.max_seq_length:
+            return None
+        return self._model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+class OnnxEncoder:
+    """
+    Эмбеддинги через ONNX Runtime (например, all-MiniLM-L6-v2, экспортированная в ONNX и квантованная в int8).
+    Рядом с файлом модели должен лежать tokenizer.json — его создаёт экспорт через optimum-cli.
+    """
+
+    def __init__(self, model_path, max_length=256):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        self._session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(model_path), 'tokenizer.json'))
+        self._tokenizer.enable_truncation(max_length)
+        self._max_length = max_length
+
+    def __call__(self, text):
+        encoding = self._tokenizer.encode(text)
+        # Текст занял все max_length токенов — скорее всего, он обрезан, и эмбеддинг описывал бы только начало
+        if len(encoding.ids) >= self._max_length:
+            return None
+        input_ids = np.array([encoding.ids], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask], dtype=np.int64)
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        hidden = self._session.run(None, feeds)[0][0]
+        return mean_pool(hidden, attention_mask[0])
+
+
+class SemanticCache:
+    """
+    Кэш ответов по смысловой близости текста.
+    Кэш приблизительный: тексты, различающиеся только числами или отрицанием, могут оказаться
+    близкими, поэтому он применяется только к коротким текстам.
+    :param encoder: Функция text -> нормированный вектор float32 или None, если текст не помещается
+                    в модель целиком (такие тексты кэш пропускает)
+    :param threshold: Минимальная косинусная близость для попадания в кэш
+    :param max_entries: Размер кэша на одно пространство имён; при переполнении вытесняются самые старые записи
+    :param max_chars: Тексты длиннее этого числа символов кэш пропускает
+    """
+
+    def __init__(self, encoder, threshold=0.95, max_entries=4096, max_chars=500):
+        self._encoder = encoder
+        self._threshold = threshold
+        self._max_chars = max_chars
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # namespace -> [матрица эмбеддингов, список ответов, число записей, индекс следующей записи]
+        self._spaces = {}
+
+    def get(self, namespace, text):
+        """Ответ для близкого по смыслу текста или None, если такого в кэше нет."""
+        emb = self._encode(text)
+        return None if emb is None else self._lookup(namespace, emb)
+
+    def put(self, namespace, text, response):
+        """Сохраняет ответ для текста."""
+        emb = self._encode(text)
+        if emb is not None:
+            self._store(namespace, emb, response)
+
+    def get_or_compute(self, namespace, text, compute):
+        """
+        Возвращает ответ для близкого текста из кэша или вызывает `compute()` и сохраняет результат.
+        Исключения из `compute()` пробрасываются, и в кэш ничего не попадает.
+        :param namespace: Пространство имён (например, целевой язык перевода)
+        :param text: Текст, по которому ищется близкий
+        :param compute: Функция без аргументов, возвращающая ответ
+        """
+        emb = self._encode(text)
+        if emb is None:
+            return compute()
+        result = self._lookup(namespace, emb)
+        if result is None:
+            result = compute()
+            self._store(namespace, emb, result)
+        return result
+
+    def _encode(self, text):
+        """Эмбеддинг текста или None, если текст слишком длинный для кэша."""
+        if len(text) > self._max_chars:
+            return None
+        return self._encoder(text)
+
+    def _lookup(self, namespace, emb):
+        with self._lock:
+            space = self._spaces.get(namespace)
+            if space is None or not space[2]:
+                return None
+            matrix, responses, count, _ = space
+            sims = matrix[:count] @ emb
+            best = int(sims.argmax())
+            if sims[best] > self._threshold:
+                return responses[best]
+        return None
+
+    def _store(self, namespace, emb, response):
+        with self._lock:
+            space = self._spaces.get(namespace)
+            if space is None:
+                matrix = np.empty((self._max_entries, emb.shape[0]), dtype=np.float32)
+                space = self._spaces[namespace] = [matrix, [None] * self._max_entries, 0, 0]
+            matrix, responses, count, pos = space
+            matrix[pos] = emb
+            responses[pos] = response
+            space[2] = min(count + 1, self._max_entries)
+            space[3] = (pos + 1) % self._max_entries
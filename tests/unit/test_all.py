@@ -25,6 +25,8 @@
 import os
 import sys
 import json
+import gzip
+import time
 import importlib
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from threading import Thread
@@ -36,12 +38,14 @@ if SRC_DIR not in sys.path:
     sys.path.insert(0, SRC_DIR)
 
 
-def _start_capture_server(response_body=None, status=200, delay_seconds=0):
+def _start_capture_server(response_body=None, status=200, delay_seconds=0, sse_chunks=None):
     """
     Запускает локальный HTTP-сервер, который:
     - принимает POST запросы
     - сохраняет заголовки и тела в server.last_request и server.requests
     - возвращает response_body (словарь -> JSON) с указанным статусом
+    - если задан sse_chunks, на запросы с `"stream": true` отвечает потоком SSE:
+      по событию `data: {"response": chunk}` на каждый фрагмент, затем `data: [DONE]`
 
     Возвращает (server, url)
     """
@@ -66,6 +70,19 @@ def _start_capture_server(response_body=None, status=200, delay_seconds=0):
                 import time
                 time.sleep(delay_seconds)
 
+            if sse_chunks is not None and json.loads(body).get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                self.wfile.write(b': comment line\n\n')
+                for chunk in sse_chunks:
+                    self.wfile.write(b'data: ' + json.dumps({'response': chunk}).encode('utf-8') + b'\n\n')
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                # Всё после [DONE] клиент должен игнорировать
+                self.wfile.write(b'data: {"response": "IGNORED"}\n\n')
+                return
+
             self.send_response(status)
             self.send_header('Content-Type', 'application/json; charset=utf-8')
             self.end_headers()
@@ -347,3 +364,427 @@ def test_get_root_returns_form():
     assert '<textarea' in html
     assert '<select' in html
     assert 'Перевести' in html
+
+
+def test_call_llm_cache_and_metrics():
+    """
+    Проверяет, что повторный вызов с теми же (model_name, prompt) берётся из кэша,
+    ошибки (в том числе ответ без поля `response`) в кэш не попадают,
+    а `/metrics` отдаёт счётчики попаданий и промахов.
+    """
+    server, url = _start_capture_server(response_body={'response': 'CACHED_OK'}, status=200)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+
+        assert app.call_llm('m', 'same prompt') == 'CACHED_OK'
+        assert app.call_llm('m', 'same prompt') == 'CACHED_OK'
+        assert len(server.requests) == 1
+
+        # Другая модель — другой ключ кэша
+        app.call_llm('other-model', 'same prompt')
+        assert len(server.requests) == 2
+
+        metrics = app.app.test_client().get('/metrics').get_json()
+        assert metrics['hits'] == 1
+        assert metrics['misses'] == 2
+        assert metrics['size'] == 2
+    finally:
+        _stop_server(server)
+
+    # Ошибка соединения не попадает в кэш
+    os.environ['MENTORPIECE_API_URL'] = 'http://127.0.0.1:9/v1/process-ai-request'
+    app = _reload_app()
+    assert 'Ошибка при обращении к LLM API' in app.call_llm('m', 'p')
+    assert len(app._CACHE) == 0
+
+    # Ответ 200 без поля `response` — тоже ошибка, а не перевод, и в кэш не попадает
+    server, url = _start_capture_server(response_body={'other': 1}, status=200)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        app = _reload_app()
+        result = app.call_llm('m', 'p')
+        assert 'Ошибка при обращении к LLM API' in result and 'Нет ответа от модели.' in result
+        assert len(app._CACHE) == 0
+        app.call_llm('m', 'p')
+        assert len(server.requests) == 2
+    finally:
+        _stop_server(server)
+
+
+def test_disk_cache_survives_reload(tmp_path):
+    """
+    Проверяет, что при заданном TRANSLATOR_CACHE_DIR ответ сохраняется на диск
+    и после перезагрузки модуля (аналог перезапуска приложения) берётся из дискового кэша.
+    """
+    server, url = _start_capture_server(response_body={'response': 'DISK_OK'}, status=200)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        os.environ['TRANSLATOR_CACHE_DIR'] = str(tmp_path)
+        app = _reload_app()
+        assert app.call_llm('m', 'persist me') == 'DISK_OK'
+        app.DISK_CACHE.close()
+
+        app = _reload_app()
+        assert app.call_llm('m', 'persist me') == 'DISK_OK'
+        assert len(server.requests) == 1
+        assert app.app.test_client().get('/metrics').get_json()['disk_hits'] == 1
+        app.DISK_CACHE.close()
+    finally:
+        os.environ.pop('TRANSLATOR_CACHE_DIR', None)
+        _stop_server(server)
+
+
+def test_translate_stream_route():
+    """
+    Проверяет потоковый маршрут `/translate-stream`: запрос на перевод уходит с `"stream": true`,
+    клиент получает события SSE с переводом и затем с оценкой.
+    Тестовый сервер отвечает обычным JSON — перевод приходит одним фрагментом.
+    """
+    server, url = _start_capture_server(response_body={'response': 'STREAMED'}, status=200)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+        client = app.app.test_client()
+
+        resp = client.post('/translate-stream', data={'original_text': 'Привет', 'language': 'fr'})
+        assert resp.status_code == 200
+        assert resp.mimetype == 'text/event-stream'
+
+        events = [json.loads(line[len('data:'):]) for line in resp.get_data(as_text=True).split('\n\n') if line]
+        assert events == [{'translation': 'STREAMED'}, {'verdict': 'STREAMED'}]
+
+        translate_payload = json.loads(server.requests[0]['body'].decode('utf-8'))
+        assert translate_payload['stream'] is True
+        assert 'на French' in translate_payload['prompt']
+        judge_payload = json.loads(server.requests[1]['body'].decode('utf-8'))
+        assert 'Перевод: STREAMED' in judge_payload['prompt']
+    finally:
+        _stop_server(server)
+
+
+def test_concurrent_identical_calls_are_coalesced():
+    """
+    Проверяет, что одновременные одинаковые вызовы `call_llm` отправляют к API один запрос,
+    а результат получают все вызывающие.
+    """
+    server, url = _start_capture_server(response_body={'response': 'SHARED'}, status=200, delay_seconds=0.5)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+
+        results = []
+        threads = [Thread(target=lambda: results.append(app.call_llm('m', 'same'))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == ['SHARED'] * 4
+        assert len(server.requests) == 1
+        assert app._INFLIGHT == {}
+    finally:
+        _stop_server(server)
+
+
+def test_concurrent_stream_translations_are_coalesced():
+    """
+    Проверяет, что потоковый перевод участвует в объединении одинаковых запросов: пока первый
+    поток перевода идёт, второй потоковый запрос и обычная форма с тем же текстом ждут его,
+    и к API уходит один запрос перевода и один запрос оценки.
+    """
+    server, url = _start_capture_server(
+        response_body={'response': 'JUDGED'}, status=200, delay_seconds=0.5, sse_chunks=['Hel', 'lo']
+    )
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+        data = {'original_text': 'Привет', 'language': 'en'}
+
+        bodies = []
+
+        def post(path):
+            bodies.append(app.app.test_client().post(path, data=data).get_data(as_text=True))
+
+        leader = Thread(target=post, args=('/translate-stream',))
+        leader.start()
+        time.sleep(0.2)
+        followers = [Thread(target=post, args=(path,)) for path in ('/translate-stream', '/')]
+        for t in followers:
+            t.start()
+        for t in [leader] + followers:
+            t.join()
+
+        assert len(bodies) == 3
+        stream_bodies = [b for b in bodies if b.startswith('data:')]
+        # Первый поток получает фрагменты, второй — склеенный перевод одним событием
+        assert sorted(stream_bodies) == sorted([
+            'data: {"translation":"Hel"}\n\ndata: {"translation":"lo"}\n\ndata: {"verdict":"JUDGED"}\n\n',
+            'data: {"translation":"Hello"}\n\ndata: {"verdict":"JUDGED"}\n\n',
+        ])
+        form_body = next(b for b in bodies if not b.startswith('data:'))
+        assert 'Hello' in form_body
+        assert len(server.requests) == 2
+        assert app._INFLIGHT == {}
+    finally:
+        _stop_server(server)
+
+
+def test_gzip_request_body():
+    """
+    Проверяет, что при MENTORPIECE_GZIP_REQUESTS=1 длинное тело запроса сжимается gzip
+    и отправляется с заголовком Content-Encoding, а короткое уходит без сжатия.
+    """
+    server, url = _start_capture_server(response_body={'response': 'ok'}, status=200)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        os.environ['MENTORPIECE_GZIP_REQUESTS'] = '1'
+        app = _reload_app()
+
+        assert app.call_llm('m', 'A' * 20000) == 'ok'
+        last = server.last_request
+        assert last['headers'].get('Content-Encoding') == 'gzip'
+        assert len(last['body']) < 20000
+        payload = json.loads(gzip.decompress(last['body']).decode('utf-8'))
+        assert payload['prompt'] == 'A' * 20000
+
+        app.call_llm('m', 'short')
+        assert 'Content-Encoding' not in server.last_request['headers']
+        assert json.loads(server.last_request['body'].decode('utf-8'))['prompt'] == 'short'
+    finally:
+        os.environ.pop('MENTORPIECE_GZIP_REQUESTS', None)
+        _stop_server(server)
+
+
+def test_empty_input_skips_llm_calls():
+    """
+    Проверяет, что форма с пустым (или состоящим из пробелов) текстом
+    не обращается к LLM API и показывает подсказку пользователю.
+    """
+    server, url = _start_capture_server(response_body={'response': 'SHOULD_NOT_BE_CALLED'}, status=200)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+        client = app.app.test_client()
+
+        resp = client.post('/', data={'original_text': '   \n', 'language': 'de'})
+        assert resp.status_code == 200
+        html = resp.get_data(as_text=True)
+        assert 'Введите текст для перевода.' in html
+        assert 'SHOULD_NOT_BE_CALLED' not in html
+
+        stream = client.post('/translate-stream', data={'original_text': '', 'language': 'en'})
+        assert 'Введите текст для перевода.' in stream.get_data(as_text=True)
+
+        assert getattr(server, 'requests', []) == []
+    finally:
+        _stop_server(server)
+
+
+def test_semantic_cache_logic():
+    """
+    Проверяет `SemanticCache` без sentence-transformers: энкодер-заглушка сопоставляет тексту
+    фиксированный единичный вектор. Покрываются порог близости, пространства имён,
+    некэширование исключений и вытеснение самых старых записей.
+    """
+    np = pytest.importorskip('numpy')
+    from semantic_cache import SemanticCache
+
+    vectors = {
+        'a': [1.0, 0.0, 0.0],
+        'a-near': [1.0, 0.1, 0.0],  # косинусная близость к 'a' ≈ 0.995
+        'a-far': [1.0, 0.5, 0.0],   # ≈ 0.894 — ниже порога 0.95
+        'b': [0.0, 1.0, 0.0],
+        'c': [0.0, 0.0, 1.0],
+    }
+
+    def encoder(text):
+        v = np.array(vectors[text], dtype=np.float32)
+        return v / np.linalg.norm(v)
+
+    calls = []
+
+    def compute(value):
+        def _compute():
+            calls.append(value)
+            return value
+        return _compute
+
+    cache = SemanticCache(encoder, threshold=0.95, max_entries=2)
+
+    # Порог: близкий текст берётся из кэша, далёкий вычисляется заново
+    assert cache.get_or_compute('en', 'a', compute('A')) == 'A'
+    assert cache.get_or_compute('en', 'a-near', compute('A2')) == 'A'
+    assert cache.get_or_compute('en', 'a-far', compute('A3')) == 'A3'
+    assert calls == ['A', 'A3']
+
+    # Пространства имён изолированы
+    assert cache.get_or_compute('fr', 'a', compute('FR')) == 'FR'
+
+    # Исключение пробрасывается и не попадает в кэш
+    def failing():
+        raise RuntimeError('boom')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute('de', 'b', failing)
+    assert cache.get_or_compute('de', 'b', compute('B')) == 'B'
+
+    # Вытеснение: в 'en' уже 'a' и 'a-far'; запись 'c' вытесняет самую старую ('a')
+    calls.clear()
+    assert cache.get_or_compute('en', 'c', compute('C')) == 'C'
+    assert cache.get_or_compute('en', 'a', compute('A-again')) == 'A-again'
+    assert cache.get_or_compute('en', 'c', compute('C2')) == 'C'
+    assert calls == ['C', 'A-again']
+
+
+def test_circuit_breaker_fails_fast():
+    """
+    Проверяет автомат защиты: после серии ошибок API (здесь порог уменьшен до 1)
+    следующий вызов `call_llm` сразу возвращает строку ошибки, не обращаясь к серверу.
+    """
+    server, url = _start_capture_server(response_body={}, status=500)
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+        app._BREAKER.fail_max = 1
+
+        assert 'Ошибка при обращении к LLM API' in app.call_llm('m', 'first')
+        assert app._BREAKER.current_state == 'open'
+        sent = len(server.requests)
+
+        result = app.call_llm('m', 'second')
+        assert 'Ошибка при обращении к LLM API' in result
+        assert len(server.requests) == sent
+    finally:
+        _stop_server(server)
+
+
+def test_translate_stream_sse_and_cache():
+    """
+    Проверяет потоковый маршрут с настоящим SSE-ответом API: клиент получает по событию
+    `translation` на каждый фрагмент, промпт оценки содержит склеенный перевод.
+    Повторный запрос того же текста берёт перевод и оценку из кэша, не обращаясь к API.
+    """
+    server, url = _start_capture_server(
+        response_body={'response': 'JUDGED'}, status=200, sse_chunks=['Hel', 'lo, ', 'world']
+    )
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+        client = app.app.test_client()
+
+        def events(resp):
+            return [json.loads(line[len('data:'):]) for line in resp.get_data(as_text=True).split('\n\n') if line]
+
+        data = {'original_text': 'Привет, мир', 'language': 'en'}
+        assert events(client.post('/translate-stream', data=data)) == [
+            {'translation': 'Hel'}, {'translation': 'lo, '}, {'translation': 'world'}, {'verdict': 'JUDGED'}
+        ]
+        assert len(server.requests) == 2
+        judge_payload = json.loads(server.requests[1]['body'].decode('utf-8'))
+        assert 'Перевод: Hello, world' in judge_payload['prompt']
+
+        # Повтор: перевод приходит одним событием из кэша, запросов к API нет
+        assert events(client.post('/translate-stream', data=data)) == [
+            {'translation': 'Hello, world'}, {'verdict': 'JUDGED'}
+        ]
+        # Обычная форма пользуется тем же кэшем
+        assert 'Hello, world' in client.post('/', data=data).get_data(as_text=True)
+        assert len(server.requests) == 2
+    finally:
+        _stop_server(server)
+
+
+def test_translate_stream_without_chunks():
+    """
+    Проверяет, что поток API без фрагментов перевода (сразу `[DONE]`) считается ошибкой:
+    клиент получает событие `error`, пустой перевод не кэшируется и не отправляется на оценку.
+    """
+    server, url = _start_capture_server(response_body={'response': 'JUDGED'}, status=200, sse_chunks=[])
+    try:
+        os.environ['MENTORPIECE_API_URL'] = url
+        os.environ['MENTORPIECE_API_KEY'] = 'key'
+        app = _reload_app()
+        client = app.app.test_client()
+
+        data = {'original_text': 'Привет, мир', 'language': 'en'}
+        body = client.post('/translate-stream', data=data).get_data(as_text=True)
+        events = [json.loads(line[len('data:'):]) for line in body.split('\n\n') if line]
+        assert events == [{'error': 'Ошибка при обращении к LLM API: Нет ответа от модели.'}]
+        # Оценка не запрашивалась
+        assert len(server.requests) == 1
+
+        # Повтор снова идёт в API: пустой перевод не попал в кэш
+        client.post('/translate-stream', data=data).get_data()
+        assert len(server.requests) == 2
+    finally:
+        _stop_server(server)
+
+
+def test_onnx_encoder_mean_pooling():
+    """
+    Проверяет усреднение и нормировку эмбеддинга в `OnnxEncoder` отдельно от ONNX Runtime:
+    токены паддинга (маска 0) не влияют на результат, вектор имеет единичную длину.
+    """
+    np = pytest.importorskip('numpy')
+    from semantic_cache import mean_pool
+
+    hidden = np.array([
+        [1.0, 0.0, 2.0],
+        [3.0, 4.0, 0.0],
+        [100.0, -100.0, 100.0],  # паддинг
+    ])
+    emb = mean_pool(hidden, np.array([1, 1, 0], dtype=np.int64))
+
+    expected = np.array([2.0, 2.0, 1.0]) / 3.0  # среднее [2, 2, 1], длина 3
+    assert emb.dtype == np.float32
+    assert np.allclose(emb, expected)
+    assert np.isclose(np.linalg.norm(emb), 1.0)
+
+
+def test_semantic_cache_skips_long_texts():
+    """
+    Проверяет, что семантический кэш не отдаёт перевод другого длинного текста с тем же началом:
+    тексты, которые энкодер обрезал бы (он возвращает None), и тексты длиннее `max_chars`
+    переводятся отдельно.
+    """
+    np = pytest.importorskip('numpy')
+    from semantic_cache import SemanticCache
+
+    def prefix_vector(text):
+        # Как у настоящей модели с ограничением длины: вектор зависит только от начала текста
+        v = np.zeros(64, dtype=np.float32)
+        v[hash(text[:8]) % 64] = 1.0
+        return v
+
+    def truncating_encoder(text):
+        return None if len(text) > 8 else prefix_vector(text)
+
+    def compute(value):
+        return lambda: value
+
+    long_a = 'Одинаковое начало, но дальше первый документ'
+    long_b = 'Одинаковое начало, но дальше второй документ'
+
+    # Энкодер сообщает об обрезке — кэш не используется
+    cache = SemanticCache(truncating_encoder)
+    assert cache.get_or_compute('en', long_a, compute('A')) == 'A'
+    assert cache.get_or_compute('en', long_b, compute('B')) == 'B'
+    assert cache.get('en', long_a) is None
+
+    # Текст длиннее max_chars пропускается, даже если энкодер сам обрезку не замечает
+    cache = SemanticCache(prefix_vector, max_chars=20)
+    assert cache.get_or_compute('en', long_a, compute('A')) == 'A'
+    assert cache.get_or_compute('en', long_b, compute('B')) == 'B'
+    # Короткие тексты по-прежнему кэшируются
+    assert cache.get_or_compute('en', 'Привет', compute('Hi')) == 'Hi'
+    assert cache.get_or_compute('en', 'Привет', compute('Other')) == 'Hi'